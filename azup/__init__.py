@@ -2,12 +2,14 @@ import inspect
 import re
 import sys
 from datetime import date, datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Callable, Dict, Iterable, List, Tuple, Type, Union
 
 from dateutil.parser import parse as dt_parse
 
 
+@lru_cache(maxsize=None)
 def cleanup_misc_chars(display_name):
     """
     >>> cleanup_misc_chars("UAE Central")
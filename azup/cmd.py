@@ -1,9 +1,33 @@
+import atexit
+import itertools
 import json
+import reprlib
+import shlex
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple, Union
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from azup import (
     cleanup_misc_chars,
@@ -13,6 +37,47 @@ from azup import (
     print_err,
 )
 
+try:
+    import orjson
+
+    def json_loads(s: Union[str, bytes]) -> Any:
+        return orjson.loads(s)
+
+    def json_dumps(o: Any) -> str:
+        return orjson.dumps(o).decode("utf-8")
+
+except ImportError:  # pragma: no cover
+
+    def json_loads(s: Union[str, bytes]) -> Any:
+        return json.loads(s)
+
+    def json_dumps(o: Any) -> str:
+        return json.dumps(o, separators=(",", ":"))
+
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+JSON_FIRST_CHARS = frozenset(b'{["-0123456789tfn')
+
+
+def looks_like_json(s: Union[str, bytes]) -> bool:
+    """
+    Cheap check of first non blank char, to skip parser on plain text
+
+    >>> looks_like_json(b' [1]'), looks_like_json("null"), looks_like_json('"a"')
+    (True, True, True)
+    >>> looks_like_json(b""), looks_like_json("  "), looks_like_json("Deleted")
+    (False, False, False)
+    """
+    head = s.lstrip()[:1]
+    if isinstance(head, str):
+        head = head.encode("utf-8")
+    return head != b"" and head[0] in JSON_FIRST_CHARS
+
+
 REC_DIR = Path("recordings")
 
 
@@ -51,25 +116,120 @@ def read_tests():
     return [(r["args"], dt_iso_parse(r["now"]), r["out"]) for r in tests]
 
 
+def to_cmd_line(argv: Union[str, List[str]]) -> str:
+    """
+    Normalize command to single string form used in logs and recordings
+
+    >>> to_cmd_line(["az", "appservice", "plan", "list"])
+    'az appservice plan list'
+    >>> to_cmd_line(["az", "--display-name", "My Plan"])
+    "az --display-name 'My Plan'"
+    >>> to_cmd_line("az account show")
+    'az account show'
+    """
+    if isinstance(argv, str):
+        return argv
+    return " ".join(map(shlex.quote, argv))
+
+
+@lru_cache(maxsize=None)
+def resolve_executable(name: str) -> str:
+    return shutil.which(name) or name
+
+
+def spawn_args(argv: List[str]) -> Dict[str, Any]:
+    """
+    Arguments for `subprocess` that let it start process with
+    `posix_spawn` instead of `fork` + `exec`: absolute executable path
+    and no `close_fds` (descriptors opened by python are not
+    inheritable anyway). Saves copying page tables of big parent process.
+
+    >>> spawn_args([sys.executable, "-V"])["close_fds"]
+    False
+    """
+    return dict(
+        args=[resolve_executable(argv[0]), *argv[1:]],
+        close_fds=False,
+    )
+
+
+def cmd_argv(cmd: str) -> List[str]:
+    """
+    Arguments of recorded command line. Recordings made before commands
+    were passed as lists have extra blanks and no quoting, those were
+    run with `str.split()`
+
+    >>> cmd_argv("az storage share list --account-name x  --only-show-errors")
+    ['az', 'storage', 'share', 'list', '--account-name', 'x', '--only-show-errors']
+    >>> cmd_argv("az --display-name 'My Plan' ")
+    ['az', '--display-name', 'My Plan']
+    >>> cmd_argv("az --name it's")
+    ['az', '--name', "it's"]
+    """
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return cmd.split()
+
+
 class CmdRun:
+    """
+    Outcome of command. Output captured from process is kept as bytes
+    and decoded only when `out` or `err` accessed.
+
+    >>> r = CmdRun([sys.executable, "-c", "print(1)"], log=lambda s: None)
+    >>> r.rc, r.raw_out.strip(), r._out is None
+    (0, b'1', True)
+    >>> r.out.strip()
+    '1'
+    >>> CmdRun("az x", 0, "[" + "0," * 100 + "0]")
+    CmdRun('az x', 0, '[0,0,0,0,0,0...,0,0,0,0,0,0]', '')
+    """
+
     cmd: str
-    out: str
-    err: str
     rc: int
+    out_b: Optional[bytes]
+    err_b: Optional[bytes]
+    _out: Optional[str]
+    _err: Optional[str]
 
-    def __init__(self, cmd, rc=None, out=None, err=None, log=print_err):
-        self.cmd = cmd
+    def __init__(
+        self, cmd: Union[str, List[str]], rc=None, out=None, err=None, log=print_err
+    ):
+        self.cmd = to_cmd_line(cmd)
         if rc is None:
-            log(f"run: {cmd}")
-            process = subprocess.run(cmd.split(), capture_output=True)
+            log(f"run: {self.cmd}")
+            argv = shlex.split(cmd) if isinstance(cmd, str) else cmd
+            process = subprocess.run(capture_output=True, **spawn_args(argv))
             self.rc = process.returncode
-            self.out = process.stdout.decode("utf-8")
-            self.err = process.stderr.decode("utf-8")
+            self.out_b, self._out = process.stdout, None
+            self.err_b, self._err = process.stderr, None
         else:
-            self.err = err or ""
-            self.out = out or ""
+            self.out_b, self._out = None, out or ""
+            self.err_b, self._err = None, err or ""
             self.rc = rc
 
+    @property
+    def out(self) -> str:
+        if self._out is None:
+            self._out = self.out_b.decode("utf-8")
+        return self._out
+
+    @property
+    def err(self) -> str:
+        if self._err is None:
+            self._err = self.err_b.decode("utf-8")
+        return self._err
+
+    @property
+    def raw_out(self) -> Union[str, bytes]:
+        """output in whatever form it is available, without decoding"""
+        return self.out_b if self._out is None else self._out
+
+    @property
+    def raw_err(self) -> Union[str, bytes]:
+        return self.err_b if self._err is None else self._err
+
     def to_list(self) -> List[Any]:
         return [self.cmd, self.rc, self.out, self.err]
 
@@ -78,60 +238,89 @@ class CmdRun:
         return CmdRun(*ll)
 
     def __repr__(self):
-        return f"CmdRun({json.dumps(self.to_list())[1:-1]})"
+        return (
+            f"CmdRun({self.cmd!r}, {self.rc}, "
+            f"{reprlib.repr(self.out)}, {reprlib.repr(self.err)})"
+        )
 
 
 class Player:
     """
     >>> p = Player([["a",0,'out','err']])
     >>> p.get("a")
-    CmdRun("a", 0, "out", "err")
+    CmdRun('a', 0, 'out', 'err')
     >>> p.assert_at_the_end()
     >>> p = Player([["a",0,'out','err']])
     >>> p.assert_at_the_end()
     Traceback (most recent call last):
     ...
-    ValueError: idx:0 not at the end:1
+    ValueError: 1 records not replayed
     >>> p.get("b")
     Traceback (most recent call last):
     ...
     ValueError: expected:a but called:b
+    >>> Player([["az a  -n x ",0,'out','err']]).get("az a -n x")
+    CmdRun('az a  -n x ', 0, 'out', 'err')
     >>>
     """
 
-    records: List[CmdRun]
-    idx: int
+    records: Deque[CmdRun]
 
     def __init__(self, ll: Iterable[Iterable[Any]]):
-        self.idx = 0
-        self.records = list(map(CmdRun.from_list, ll))
+        self.records = deque(map(CmdRun.from_list, ll))
 
     def get(self, cmd) -> CmdRun:
-        result = self.records[self.idx]
-        if result.cmd != cmd:
+        result = self.records[0]
+        if result.cmd != cmd and cmd_argv(result.cmd) != cmd_argv(cmd):
             raise ValueError(f"expected:{result.cmd} but called:{cmd}")
-        else:
-            self.idx += 1
-            return result
+        return self.records.popleft()
 
     def assert_at_the_end(self):
-        if self.idx != len(self.records):
-            raise ValueError(f"idx:{self.idx} not at the end:{len(self.records)}")
+        if self.records:
+            raise ValueError(f"{len(self.records)} records not replayed")
 
 
 RECORDS = "records"
 CMD_LINE = "cmdLine"
+MSGPACK_SUFFIX = ".msgpack"
+
+
+def read_entries(path: Path) -> Generator[Any, None, None]:
+    with path.open("rb") as fp:
+        if path.suffix == MSGPACK_SUFFIX:
+            import msgpack
+
+            yield from msgpack.Unpacker(fp, raw=False)
+        else:
+            yield from (json_loads(line) for line in fp if line.strip())
 
 
 def parse_recorder_file(file: str) -> Tuple[List[str], List[List[Any]]]:
-    load = json.load((REC_DIR / file).open("rt"))
-    return load[CMD_LINE], load[RECORDS]
+    """
+    Recorder file is a stream of entries: first is header with command
+    line, every following is one `CmdRun.to_list()`. Entries are JSON
+    Lines, or MessagePack if file has `.msgpack` suffix.
+
+    Recordings made before JSON Lines are single JSON document with
+    both command line and records in it.
+    """
+    entries = read_entries(REC_DIR / file)
+    header = next(entries)
+    if RECORDS in header:
+        entries.close()
+        return header[CMD_LINE], header[RECORDS]
+    return header[CMD_LINE], list(entries)
+
+
+def json_line(o: Any) -> bytes:
+    return (json_dumps(o) + "\n").encode("utf-8")
 
 
 class Recorder:
     file: Path
-    content: Dict[str, Any]
-    records: List[List[Any]]
+    fp: BinaryIO
+    encode: Callable[[Any], bytes]
+    lock: threading.Lock
 
     def __init__(self, file: str, cmd_line: List[str]):
         ensure_recdir()
@@ -145,29 +334,47 @@ class Recorder:
             self.file = next_file
         else:
             self.file = REC_DIR / file
-        self.content = {}
-        self.content[CMD_LINE] = cmd_line
-        self.records = []
-        self.content[RECORDS] = self.records
-        self.write()
+        if self.file.suffix == MSGPACK_SUFFIX:
+            import msgpack
+
+            self.encode = msgpack.Packer().pack
+        else:
+            self.encode = json_line
+        self.lock = threading.Lock()
+        self.fp = self.file.open("wb")
+        self.fp.write(self.encode({CMD_LINE: cmd_line}))
+        self.fp.flush()
+        atexit.register(self.close)
 
     def replay_option(self):
         return f"-replay:{self.file.name}"
 
-    def write(self):
-        json.dump(self.content, self.file.open("wt"))
-
     def record(self, run: CmdRun):
-        self.records.append(run.to_list())
-        self.write()
+        entry = self.encode(run.to_list())
+        with self.lock:
+            self.fp.write(entry)
+            self.fp.flush()
+
+    def close(self):
+        atexit.unregister(self.close)
+        if not self.fp.closed:
+            self.fp.close()
+
+
+MAX_WORKERS = 8
+# list of azure locations barely changes, but long running process
+# should see new ones eventually
+LOCATION_MAPPING_TTL = 24 * 60 * 60
 
 
 class Cmd:
-    run: CmdRun
     ctx: "c.Context"
     record_to: Recorder
     replay_from: Player
     override_utcnow: datetime
+    cache: Dict[Tuple[str, ...], Any]
+    expires: Dict[Tuple[str, ...], float]
+    key_locks: Dict[Tuple[str, ...], threading.Lock]
 
     def __init__(
         self,
@@ -178,21 +385,51 @@ class Cmd:
         self.record_to = record_to
         self.replay_from = replay_from
         self.override_utcnow = now
+        self.cache = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.local = threading.local()
+
+    @property
+    def run(self) -> CmdRun:
+        """last `CmdRun` of current thread"""
+        return self.local.run
+
+    @run.setter
+    def run(self, run: CmdRun):
+        self.local.run = run
+
+    def close(self):
+        if self.record_to is not None:
+            self.record_to.close()
 
     def q(
         self,
-        cmd: str,
+        cmd: Union[str, List[str]],
         print_out=False,
         show_err: bool = True,
         only_errors: bool = False,
+    ):
+        argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        if only_errors:
+            argv.append("--only-show-errors")
+        return self.execute(
+            to_cmd_line(argv), lambda log: CmdRun(argv, log=log), print_out, show_err
+        )
+
+    def execute(
+        self,
+        cmd: str,
+        run_fn: Callable[[Callable[[str], None]], CmdRun],
+        print_out=False,
+        show_err: bool = True,
     ):
         def log(text):
             print_err(self.ctx.secrets.hide(text))
 
-        if only_errors:
-            cmd = cmd + " --only-show-errors"
         if self.replay_from is None:
-            self.run = CmdRun(cmd, log=log)
+            self.run = run_fn(log)
         else:
             self.run = self.replay_from.get(cmd)
             log(f"fake: {cmd}")
@@ -200,21 +437,172 @@ class Cmd:
             self.record_to.record(self.run)
         if print_out:
             print_err(self.run.out)
-        if show_err and self.run.err:
+        if show_err and self.run.raw_err:
             print_err(self.run.err)
         if self.run.rc != 0:
             raise ValueError(f"rc:{self.run.rc}")
         return self
 
+    def cached(
+        self, key: Tuple[str, ...], fn: Callable[[], Any], ttl: float = None
+    ) -> Any:
+        """
+        Memoize result of idempotent lookup for lifetime of this `Cmd`,
+        or for `ttl` seconds if it is given. Concurrent callers of same
+        key wait for the first one instead of repeating lookup.
+
+        >>> cmd = Cmd()
+        >>> cmd.cached(("a", "g"), lambda: [1])
+        [1]
+        >>> cmd.cached(("a", "g"), lambda: [2])
+        [1]
+        >>> cmd.invalidate("a")
+        >>> cmd.cached(("a", "g"), lambda: [2])
+        [2]
+        >>> cmd.cached(("b",), lambda: [1], ttl=0)
+        [1]
+        >>> cmd.cached(("b",), lambda: [2], ttl=0)
+        [2]
+        >>> calls = []
+        >>> cmd.batch([lambda: cmd.cached(("c",), lambda: calls.append(1) or 1)] * 5)
+        [1, 1, 1, 1, 1]
+        >>> len(calls)
+        1
+        """
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self.expires and self.expires[key] <= time.monotonic():
+                self.cache.pop(key, None)
+                self.expires.pop(key, None)
+            if key not in self.cache:
+                self.cache[key] = fn()
+                if ttl is not None:
+                    self.expires[key] = time.monotonic() + ttl
+            return self.cache[key]
+
+    def batch(self, fns: Iterable[Callable[[], Any]]) -> List[Any]:
+        """
+        Call independent lookups in parallel, results are in order of `fns`.
+        Runs sequentially when recording or replaying to keep order of
+        commands deterministic.
+
+        >>> Cmd().batch([lambda: 1, lambda: 2])
+        [1, 2]
+        """
+        if self.record_to is not None or self.replay_from is not None:
+            return [fn() for fn in fns]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            return list(ex.map(lambda fn: fn(), fns))
+
+    def prefetch(self, fns: Iterable[Callable[[], Any]]):
+        """
+        Warm up cache by running cached lookups in parallel. Does nothing
+        when recording or replaying: `batch()` is sequential then anyway,
+        and skipping it keeps commands in order they are used.
+
+        >>> calls = []
+        >>> Cmd().prefetch([lambda: calls.append(1)]); calls
+        [1]
+        >>> Cmd(replay_from=Player([])).prefetch([lambda: calls.append(2)]); calls
+        [1]
+        """
+        if self.record_to is None and self.replay_from is None:
+            self.batch(fns)
+
+    def invalidate(self, *prefixes: str):
+        for key in [k for k in list(self.cache) if k[0] in prefixes]:
+            self.cache.pop(key, None)
+            self.expires.pop(key, None)
+
+    def stream_json(self, argv: List[str]) -> Iterator[Any]:
+        """
+        Yield items of JSON array printed by command while it is still
+        running. Falls back to buffered `q()` when `ijson` is not installed
+        or when recording or replaying, since whole output is kept then.
+        Output that is not JSON array raises `ValueError` either way, so
+        replay fails the same way live run does.
+
+        >>> py = lambda code: [sys.executable, "-c", code]
+        >>> array = py("import json; print(json.dumps([1, {'a': 2}]))")
+        >>> cmd = Cmd(); _ = c.Context(cmd)
+        >>> list(cmd.stream_json(array))
+        [1, {'a': 2}]
+        >>> list(cmd.stream_json(py("import sys; sys.exit(3)")))
+        Traceback (most recent call last):
+        ...
+        ValueError: rc:3
+        >>> list(cmd.stream_json(py("print('Deleted')")))
+        Traceback (most recent call last):
+        ...
+        ValueError: not json array
+        >>> list(cmd.stream_json(py("print('{}')")))
+        Traceback (most recent call last):
+        ...
+        ValueError: not json array
+        >>> player = Player([[to_cmd_line(array), 0, '[1, {"a": 2}]', ""]]
+        ...     + [[to_cmd_line(py(out)), 0, out, ""] for out in ("Deleted", "{}")])
+        >>> cmd = Cmd(replay_from=player); _ = c.Context(cmd)
+        >>> list(cmd.stream_json(array))
+        [1, {'a': 2}]
+        >>> list(cmd.stream_json(py("Deleted")))
+        Traceback (most recent call last):
+        ...
+        ValueError: not json array
+        >>> list(cmd.stream_json(py("{}")))
+        Traceback (most recent call last):
+        ...
+        ValueError: not json array
+        """
+        if ijson is None or self.record_to is not None or self.replay_from is not None:
+            raw = self.q(argv).run.raw_out
+            try:
+                data = json_loads(raw) if looks_like_json(raw) else None
+            except ValueError:
+                data = None
+            if isinstance(data, list):
+                yield from data
+                return
+        else:
+            print_err(self.ctx.secrets.hide(f"stream: {to_cmd_line(argv)}"))
+            with tempfile.TemporaryFile() as err, subprocess.Popen(
+                stdout=subprocess.PIPE, stderr=err, **spawn_args(argv)
+            ) as process:
+                try:
+                    events = ijson.parse(process.stdout, use_float=True)
+                    first = next(events, None)
+                    if first == ("", "start_array", None):
+                        yield from ijson.items(itertools.chain([first], events), "item")
+                        is_array = True
+                    else:
+                        is_array = False
+                except ijson.JSONError:
+                    is_array = False
+                rc = process.wait()
+                err.seek(0)
+                err_text = err.read().decode("utf-8")
+            if err_text:
+                print_err(err_text)
+            if rc != 0:
+                raise ValueError(f"rc:{rc}")
+            if is_array:
+                return
+        print_err(self.ctx.secrets.hide(f"not json array: {to_cmd_line(argv)}"))
+        raise ValueError("not json array")
+
     def utcnow(self):
         if self.override_utcnow:
             return self.override_utcnow
         return datetime.utcnow()
 
     def json(self, extract_secrets=None):
+        raw = self.run.raw_out
+        if not looks_like_json(raw):
+            print_err(f"not json: {self.run.out}")
+            return None
         try:
-            data = json.loads(self.run.out)
-        except:
+            data = json_loads(raw)
+        except ValueError:
             print_err(f"not json: {self.run.out}")
             return None
         if extract_secrets is not None:
@@ -227,68 +615,91 @@ class Cmd:
 
 
 class AzCmd(Cmd):
+    def list_locations(self) -> List[Dict[str, Any]]:
+        return self.q(["az", "account", "list-locations"]).json()
+
     def get_location_mapping(self) -> Dict[str, str]:
-        all_locations = self.q(f"az account list-locations").json()
-        m = {}
-        for l in all_locations:
-            name = l["name"]
-            m[cleanup_misc_chars(l["displayName"])] = name
-            m[name] = name
-        return m
+        def build():
+            all_locations = self.list_locations()
+            m = {}
+            for l in all_locations:
+                name = l["name"]
+                m[cleanup_misc_chars(l["displayName"])] = name
+                m[name] = name
+            return m
+
+        return self.cached(("location_mapping",), build, LOCATION_MAPPING_TTL)
 
     def get_acr_list(self):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az acr list -g {config.group}").json()
+        return self.cached(
+            ("acr_list", config.group),
+            lambda: self.q(["az", "acr", "list", "-g", config.group]).json(),
+        )
 
     def get_plan_list(self):
         config: c.WebServicesConfig = self.ctx.config
-        plans = [
-            p
-            for p in self.q(f"az appservice plan list").json()
-            if p["resourceGroup"] == config.group
-        ]
-        return plans
+        return self.cached(
+            ("plan_list", config.group),
+            lambda: [
+                p
+                for p in self.q(["az", "appservice", "plan", "list"]).json()
+                if p["resourceGroup"] == config.group
+            ],
+        )
 
     def get_storage_list(self):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az storage account list -g {config.group}").json()
+        return self.cached(
+            ("storage_list", config.group),
+            lambda: self.q(
+                ["az", "storage", "account", "list", "-g", config.group]
+            ).json(),
+        )
 
     def get_acr_repo_list(self, acr: "c.Acr"):
-        return self.q(f"az acr repository list -n {acr.name}").json()
+        return self.stream_json(["az", "acr", "repository", "list", "-n", acr.name])
 
     def get_acr_credential(self, acr: "c.Acr"):
-        return self.q(f"az acr credential show -n {acr.name}").json(
+        return self.q(["az", "acr", "credential", "show", "-n", acr.name]).json(
             lambda json: (("hidden_acr_pwd", pwd["value"]) for pwd in json["passwords"])
         )
 
     def show_manifests(self, repo: "c.Repository", acr: "c.Acr" = None):
         if acr is None:
             acr = repo.path.parent(2).get_state()
-        return self.q(
-            f"az acr repository show-manifests -n {acr.name}"
-            f" --repository {repo.name}"
-        ).json()
+        return self.stream_json(
+            ["az", "acr", "repository", "show-manifests", "-n", acr.name]
+            + ["--repository", repo.name]
+        )
 
     def list_storage_keys(self, storage: "c.Storage"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az storage account keys list -g {config.group}" f" -n {storage.name}"
+            ["az", "storage", "account", "keys", "list", "-g", config.group]
+            + ["-n", storage.name]
         ).json(lambda json: (("hidden_storage_key", pwd["value"]) for pwd in json))
 
     def list_file_shares(self, storage: "c.Storage"):
         return self.q(
-            f"az storage share list --account-name {storage.name} ", only_errors=True
+            ["az", "storage", "share", "list", "--account-name", storage.name],
+            only_errors=True,
         ).json()
 
     def list_services(self):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az webapp list --resource-group {config.group}").json()
+        return self.cached(
+            ("services", config.group),
+            lambda: self.q(
+                ["az", "webapp", "list", "--resource-group", config.group]
+            ).json(),
+        )
 
     def list_webapp_shares(self, service: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config storage-account list "
-            f"--resource-group {config.group} --name {service.name}",
+            ["az", "webapp", "config", "storage-account", "list"]
+            + ["--resource-group", config.group, "--name", service.name],
             only_errors=True,
         ).json()
 
@@ -296,21 +707,25 @@ class AzCmd(Cmd):
         repo: c.Repository = iv.repo_path.get_config()
         acr: c.Acr = iv.repo_path.parent(2).get_config()
         return self.q(
-            f"az acr repository delete --yes -n {acr.name} "
-            f"--image {repo.name}@{iv.digest}",
+            ["az", "acr", "repository", "delete", "--yes", "-n", acr.name]
+            + ["--image", f"{repo.name}@{iv.digest}"],
             only_errors=True,
         ).text()
 
     def delete_webapp(self, service: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
+        self.invalidate("services", "container")
         return self.q(
-            f"az webapp delete -n {service.name} -g {config.group} --keep-empty-plan"
+            ["az", "webapp", "delete", "-n", service.name, "-g", config.group]
+            + ["--keep-empty-plan"]
         ).text()
 
     def delete_app_plan(self, plan: "c.AppServicePlanState"):
         config: c.WebServicesConfig = self.ctx.config
+        self.invalidate("plan_list")
         return self.q(
-            f"az appservice plan delete -y -n {plan.name} -g {config.group} "
+            ["az", "appservice", "plan", "delete", "-y", "-n", plan.name]
+            + ["-g", config.group]
         ).text()
 
     def create_app_plan(self, plan: "c.AppServicePlan"):
@@ -318,30 +733,38 @@ class AzCmd(Cmd):
         kind_opt = educated_guess(
             plan.kind, {"--is-linux": [], "": ["app"], "--hyper-v": []}
         )
+        self.invalidate("plan_list")
         return self.q(
-            f"az appservice plan create -n {plan.name} -g {state.group} --sku {plan.sku} -l {state.location_id(plan.location)} {kind_opt} "
+            ["az", "appservice", "plan", "create", "-n", plan.name]
+            + ["-g", state.group, "--sku", plan.sku]
+            + ["-l", state.location_id(plan.location)]
+            + ([kind_opt] if kind_opt else [])
         ).text()
 
     def update_app_plan_sku(self, plan: "c.AppServicePlan"):
         state: c.WebServicesState = self.ctx.state
+        self.invalidate("plan_list")
         return self.q(
-            f"az appservice plan update -n {plan.name} -g {state.group} --sku {plan.sku}"
+            ["az", "appservice", "plan", "update", "-n", plan.name]
+            + ["-g", state.group, "--sku", plan.sku]
         ).text()
 
     def create_webapp(self, service: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
         plan: c.AppServicePlan = service.path.parent(2).get_config()
-        append = ""
+        append: List[str] = []
         if (
             service.container.acr is not None
             and service.container.acr in self.ctx.state.acrs
         ):
             acr: c.AcrState = self.ctx.state.acrs[service.container.acr]  # type:ignore
-            append = f" -s {acr.get_credentials()[0]} -w {acr.get_credentials()[1]}"
+            append = ["-s", acr.get_credentials()[0], "-w", acr.get_credentials()[1]]
 
+        self.invalidate("services", "container")
         return self.q(
-            f"az webapp create -n {service.name} -g {config.group} "
-            f"-p {plan.name} -i {service.docker_url()}{append}",
+            ["az", "webapp", "create", "-n", service.name, "-g", config.group]
+            + ["-p", plan.name, "-i", service.docker_url()]
+            + append,
             only_errors=True,
         ).json()
 
@@ -349,29 +772,35 @@ class AzCmd(Cmd):
         config: c.WebServicesConfig = self.ctx.config
         service: c.Service = mount.path.parent(2).get_config()
         return self.q(
-            f"az webapp config storage-account add "
-            f"--resource-group {config.group} --name {service.name} "
-            f"--custom-id {mount.default_custom_id()} "
-            f"--storage-type AzureFiles --share-name {mount.share} "
-            f"--account-name {mount.account} "
-            f"--access-key {mount.access_key()} --mount-path {mount.name}",
+            ["az", "webapp", "config", "storage-account", "add"]
+            + ["--resource-group", config.group, "--name", service.name]
+            + ["--custom-id", mount.default_custom_id()]
+            + ["--storage-type", "AzureFiles", "--share-name", mount.share]
+            + ["--account-name", mount.account]
+            + ["--access-key", mount.access_key(), "--mount-path", mount.name],
             only_errors=True,
         ).json()
 
     def list_cosmos_dbs(self):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az cosmosdb list -g {config.group}").json()
+        return self.cached(
+            ("cosmos_dbs", config.group),
+            lambda: self.q(["az", "cosmosdb", "list", "-g", config.group]).json(),
+        )
 
     def create_mongo_db(self, mongo: "c.MongoDb"):
         config: c.WebServicesConfig = self.ctx.config
+        self.invalidate("cosmos_dbs")
         return self.q(
-            f"az cosmosdb create -n {mongo.name} -g {config.group} --kind MongoDB"
+            ["az", "cosmosdb", "create", "-n", mongo.name, "-g", config.group]
+            + ["--kind", "MongoDB"]
         ).json()
 
     def get_mongo_connections(self, mongo: "c.MongoDb"):
         config: c.WebServicesConfig = self.ctx.config
         json = self.q(
-            f"az cosmosdb keys list --type connection-strings -n {mongo.name} -g {config.group}"
+            ["az", "cosmosdb", "keys", "list", "--type", "connection-strings"]
+            + ["-n", mongo.name, "-g", config.group]
         ).json(
             lambda json: (
                 ("hidden_connection_string", c["connectionString"])
@@ -384,14 +813,15 @@ class AzCmd(Cmd):
     def set_app_settings(self, app: "c.Service", k: str, v: str):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config appsettings set -n {app.name} -g {config.group} "
-            f"--settings {k}={v}"
+            ["az", "webapp", "config", "appsettings", "set"]
+            + ["-n", app.name, "-g", config.group, "--settings", f"{k}={v}"]
         ).json()
 
     def get_app_settings(self, app: "c.ServiceState"):
         config: c.WebServicesConfig = self.ctx.config
         return self.q(
-            f"az webapp config appsettings list -n {app.name} -g {config.group}"
+            ["az", "webapp", "config", "appsettings", "list"]
+            + ["-n", app.name, "-g", config.group]
         ).json()
 
     # az webapp config storage-account list --resource-group {config.group} --name {ss.name}
@@ -399,23 +829,189 @@ class AzCmd(Cmd):
 
     def get_service_props(self, ss: "c.ServiceState"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(
-            f"az webapp config container show -n {ss.name} -g {config.group}"
-        ).json()
+        return self.cached(
+            ("container", config.group, ss.name),
+            lambda: self.q(
+                ["az", "webapp", "config", "container", "show"]
+                + ["-n", ss.name, "-g", config.group]
+            ).json(),
+        )
 
     def update_webapp_docker(self, ss: "c.ServiceState"):
         config: c.WebServicesConfig = self.ctx.config
+        self.invalidate("services", "container")
         return self.q(
-            f"az webapp config container set -n {ss.name} "
-            f"-g {config.group} -c {ss.docker}"
+            ["az", "webapp", "config", "container", "set"]
+            + ["-n", ss.name, "-g", config.group, "-c", ss.docker]
         ).json()
 
     def restart_webapp(self, ss: "c.Service"):
         config: c.WebServicesConfig = self.ctx.config
-        return self.q(f"az webapp restart -n {ss.name} -g {config.group}").text()
+        return self.q(
+            ["az", "webapp", "restart", "-n", ss.name, "-g", config.group]
+        ).text()
 
     def get_account(self):
-        return self.q(f"az account show").json()
+        return self.q(["az", "account", "show"]).json()
+
+
+ARM_URL = "https://management.azure.com"
+ARM_SCOPE = f"{ARM_URL}/.default"
+TOKEN_REFRESH_MARGIN = 300
+
+
+def flatten_arm_resource(d: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Make ARM REST resource look like `az` cli output: lift `properties`
+    to top level and add `resourceGroup`
+
+    >>> flatten_arm_resource({"id": "/subscriptions/s/resourceGroups/g/x/y",
+    ...     "name": "y", "properties": {"accessTier": "Hot"}})
+    {'id': '/subscriptions/s/resourceGroups/g/x/y', 'name': 'y', 'accessTier': 'Hot', 'resourceGroup': 'g'}
+    """
+    flat = {k: v for k, v in d.items() if k != "properties"}
+    flat.update(d.get("properties") or {})
+    parts = flat.get("id", "").split("/", 5)
+    if len(parts) > 4 and parts[3].lower() == "resourcegroups":
+        flat.setdefault("resourceGroup", parts[4])
+    return flat
+
+
+class AzRestCmd(AzCmd):
+    """
+    Serves read only listings directly from ARM REST API over one
+    keep-alive session, shared by `batch()` threads, instead of
+    starting `az` for each of them.
+    Everything else still goes through `az` cli. Calls are recorded
+    as `rest GET <path>` so `Recorder` and `Player` work unchanged.
+
+    Token comes from `AzureCliCredential`, so it is for same identity
+    and subscription as `az account show` used in `subscription_path()`.
+
+    Requires `requests` and `azure-identity`.
+    """
+
+    session: Any
+    credential: Any
+    token: Any
+    auth_lock: threading.Lock
+
+    def __init__(self, *args, **kwargs):
+        super(AzRestCmd, self).__init__(*args, **kwargs)
+        self.session = None
+        self.credential = None
+        self.token = None
+        self.auth_lock = threading.Lock()
+
+    def bearer(self) -> str:
+        with self.auth_lock:
+            if self.token is None or (
+                self.token.expires_on - TOKEN_REFRESH_MARGIN < time.time()
+            ):
+                if self.credential is None:
+                    from azure.identity import AzureCliCredential
+
+                    self.credential = AzureCliCredential()
+                self.token = self.credential.get_token(ARM_SCOPE)
+            return f"Bearer {self.token.token}"
+
+    def new_session(self) -> Any:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        # keep connection per `batch()` worker alive
+        session.mount("https://", HTTPAdapter(pool_maxsize=MAX_WORKERS))
+        return session
+
+    def get_session(self) -> Any:
+        with self.lock:
+            if self.session is None:
+                self.session = self.new_session()
+            return self.session
+
+    def close(self):
+        super(AzRestCmd, self).close()
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def arm_get(self, cmd: str, path: str, api_version: str) -> CmdRun:
+        session = self.get_session()
+        url = f"{ARM_URL}{path}"
+        params: Dict[str, str] = {"api-version": api_version}
+        values: List[Any] = []
+        while url:
+            response = session.get(
+                url, params=params, headers={"Authorization": self.bearer()}
+            )
+            if response.status_code != 200:
+                return CmdRun(cmd, 1, "", response.text)
+            page = response.json()
+            values.extend(map(flatten_arm_resource, page.get("value", [])))
+            url, params = page.get("nextLink"), {}
+        return CmdRun(cmd, 0, json_dumps(values))
+
+    def rest(self, path: str, api_version: str):
+        cmd = f"rest GET {path}?api-version={api_version}"
+
+        def run(log):
+            log(f"run: {cmd}")
+            return self.arm_get(cmd, path, api_version)
+
+        return self.execute(cmd, run)
+
+    def subscription_path(self) -> str:
+        account = self.cached(("account",), self.get_account)
+        return f"/subscriptions/{account['id']}"
+
+    def group_path(self) -> str:
+        config: c.WebServicesConfig = self.ctx.config
+        return f"{self.subscription_path()}/resourceGroups/{config.group}"
+
+    def list_locations(self) -> List[Dict[str, Any]]:
+        return self.rest(f"{self.subscription_path()}/locations", "2022-12-01").json()
+
+    def get_acr_list(self):
+        config: c.WebServicesConfig = self.ctx.config
+        return self.cached(
+            ("acr_list", config.group),
+            lambda: self.rest(
+                f"{self.group_path()}/providers/Microsoft.ContainerRegistry/registries",
+                "2023-07-01",
+            ).json(),
+        )
+
+    def get_plan_list(self):
+        config: c.WebServicesConfig = self.ctx.config
+        return self.cached(
+            ("plan_list", config.group),
+            lambda: self.rest(
+                f"{self.group_path()}/providers/Microsoft.Web/serverfarms",
+                "2022-09-01",
+            ).json(),
+        )
+
+    def get_storage_list(self):
+        config: c.WebServicesConfig = self.ctx.config
+        return self.cached(
+            ("storage_list", config.group),
+            lambda: self.rest(
+                f"{self.group_path()}/providers/Microsoft.Storage/storageAccounts",
+                "2023-01-01",
+            ).json(),
+        )
+
+    def list_cosmos_dbs(self):
+        config: c.WebServicesConfig = self.ctx.config
+        return self.cached(
+            ("cosmos_dbs", config.group),
+            lambda: self.rest(
+                f"{self.group_path()}/providers/Microsoft.DocumentDB/databaseAccounts",
+                "2023-04-15",
+            ).json(),
+        )
 
 
 import azup.context as c
@@ -545,6 +545,16 @@ class WebServicesState(WebServicesConfig):
         az_cmd = self.path.ctx.az_cmd
         config: WebServicesConfig = self.path.get_config()
         self.group = config.group
+        az_cmd.prefetch(
+            [
+                az_cmd.get_location_mapping,
+                az_cmd.get_acr_list,
+                az_cmd.list_cosmos_dbs,
+                az_cmd.get_storage_list,
+                az_cmd.get_plan_list,
+                az_cmd.list_services,
+            ]
+        )
         self.location_mapping = az_cmd.get_location_mapping()
 
         self.acrs = {
@@ -570,7 +580,7 @@ class WebServicesState(WebServicesConfig):
             for d in az_cmd.get_plan_list()
         }
         for d in az_cmd.list_services():
-            plan_name = d["appServicePlanId"].split("/")[-1]
+            plan_name = d["appServicePlanId"].rpartition("/")[2]
             plan = self.plans[plan_name]
             name = d["name"]
             plan.services[name] = ServiceState.build(plan, "services", name).load(d)
@@ -3,7 +3,7 @@ from typing import List, Dict
 
 import azup.context as c
 from azup import CliActions, filter_options, print_err
-from azup.cmd import AzCmd
+from azup.cmd import AzCmd, AzRestCmd
 from azup.yaml import to_yaml
 
 
@@ -105,7 +105,7 @@ class Actions(CliActions):
 def main(args: List[str] = sys.argv[1:], az_cmd: AzCmd = None):
     args, options = filter_options(args)
     if az_cmd is None:
-        az_cmd = AzCmd()
+        az_cmd = AzRestCmd() if "rest" in options else AzCmd()
     actions = Actions(az_cmd)
     actions._show_help = len(args) == 0 or "h" in options
     out = actions._invoke(*args)
@@ -0,0 +1,222 @@
+import gc
+import json
+import time
+import weakref
+from types import SimpleNamespace
+
+import pytest
+
+from azup import cmd
+from azup.cmd import (
+    CMD_LINE,
+    RECORDS,
+    TOKEN_REFRESH_MARGIN,
+    AzCmd,
+    AzRestCmd,
+    CmdRun,
+    Player,
+    Recorder,
+    parse_recorder_file,
+)
+from azup.context import Context
+
+
+@pytest.fixture
+def rec_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / cmd.REC_DIR
+
+
+def test_record_and_replay(rec_dir):
+    rec = Recorder("rt.json", ["dump_config", "g"])
+    rec.record(CmdRun("az account show", 0, '{"id": "s"}', ""))
+    rec.record(CmdRun("az acr list -g g", 0, "[]\n", "warn\n"))
+    rec.close()
+
+    cmd_line, records = parse_recorder_file("rt.json")
+    assert cmd_line == ["dump_config", "g"]
+    player = Player(records)
+    assert player.get("az account show").out == '{"id": "s"}'
+    run = player.get("az acr list -g g")
+    assert (run.rc, run.out, run.err) == (0, "[]\n", "warn\n")
+    player.assert_at_the_end()
+
+
+def test_replay_legacy_recording(rec_dir):
+    rec_dir.mkdir()
+    legacy = {CMD_LINE: ["list_images", "c.yml"], RECORDS: [["az x", 0, "[]", ""]]}
+    (rec_dir / "old.json").write_text(json.dumps(legacy))
+
+    cmd_line, records = parse_recorder_file("old.json")
+    assert cmd_line == ["list_images", "c.yml"]
+    player = Player(records)
+    assert player.get("az x").out == "[]"
+    player.assert_at_the_end()
+
+
+class Token:
+    def __init__(self, token, expires_on):
+        self.token = token
+        self.expires_on = expires_on
+
+
+class StubCredential:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.issued = 0
+
+    def get_token(self, scope):
+        self.issued += 1
+        return Token(f"t{self.issued}", time.time() + self.ttl)
+
+
+class Response:
+    def __init__(self, status_code, page):
+        self.status_code = status_code
+        self.page = page
+        self.text = json.dumps(page)
+
+    def json(self):
+        return self.page
+
+
+class StubSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self.closed = False
+
+    def get(self, url, params, headers):
+        self.calls.append((url, params, headers["Authorization"]))
+        return self.responses.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class StubRestCmd(AzRestCmd):
+    def __init__(self, responses, ttl=3600, **kwargs):
+        super(StubRestCmd, self).__init__(**kwargs)
+        self.stub_session = StubSession(responses)
+        self.sessions = 0
+        self.credential = StubCredential(ttl)
+        self.cache[("account",)] = {"id": "s"}
+        Context(self).config = SimpleNamespace(group="g")
+
+    def new_session(self):
+        self.sessions += 1
+        return self.stub_session
+
+
+ACR_PATH = "/subscriptions/s/resourceGroups/g/providers/Microsoft.ContainerRegistry"
+ACR = {"id": f"{ACR_PATH}/registries/a", "name": "a", "properties": {"sku": 1}}
+
+
+def test_rest_pages_and_replay(rec_dir):
+    next_link = f"https://management.azure.com{ACR_PATH}/registries?page=2"
+    pages = [
+        Response(200, {"value": [ACR], "nextLink": next_link}),
+        Response(200, {"value": [{"name": "b"}]}),
+    ]
+    rec = Recorder("rest.json", ["dump_config", "g", "-rest"])
+    live = StubRestCmd(pages, record_to=rec)
+    acrs = live.get_acr_list()
+    live.close()
+    assert acrs == [
+        {"id": ACR["id"], "name": "a", "sku": 1, "resourceGroup": "g"},
+        {"name": "b"},
+    ]
+    calls = live.stub_session.calls
+    assert [c[1] for c in calls] == [{"api-version": "2023-07-01"}, {}]
+    assert calls[1][0] == next_link
+
+    cmd_line, records = parse_recorder_file("rest.json")
+    assert records[0][0] == f"rest GET {ACR_PATH}/registries?api-version=2023-07-01"
+    replay = StubRestCmd([], replay_from=Player(records))
+    assert replay.get_acr_list() == acrs
+    replay.replay_from.assert_at_the_end()
+
+
+def test_rest_error_is_rc_1(rec_dir):
+    rest = StubRestCmd([Response(403, {"error": "denied"})])
+    with pytest.raises(ValueError, match="rc:1"):
+        rest.get_acr_list()
+    assert rest.run.rc == 1 and "denied" in rest.run.err
+
+
+def test_rest_token_refresh():
+    expiring = StubRestCmd([], ttl=TOKEN_REFRESH_MARGIN - 1)
+    assert [expiring.bearer(), expiring.bearer()] == ["Bearer t1", "Bearer t2"]
+    fresh = StubRestCmd([], ttl=TOKEN_REFRESH_MARGIN + 60)
+    assert [fresh.bearer(), fresh.bearer()] == ["Bearer t1", "Bearer t1"]
+
+
+def test_rest_batch_resolves_subscription_once():
+    class CountingRestCmd(StubRestCmd):
+        accounts = 0
+
+        def get_account(self):
+            self.accounts += 1
+            time.sleep(0.05)
+            return {"id": "s"}
+
+    rest = CountingRestCmd([Response(200, {"value": []}) for _ in range(4)])
+    del rest.cache[("account",)]
+    results = rest.batch(
+        [
+            rest.get_acr_list,
+            rest.get_plan_list,
+            rest.get_storage_list,
+            rest.list_cosmos_dbs,
+        ]
+    )
+    assert results == [[], [], [], []]
+    assert rest.accounts == 1
+    assert rest.sessions == 1
+    rest.close()
+    assert rest.stub_session.closed
+
+
+def test_closed_recorder_is_released(rec_dir):
+    rec = Recorder("gone.json", ["list_images"])
+    ref = weakref.ref(rec)
+    rec.close()
+    del rec
+    gc.collect()
+    assert ref() is None
+
+
+def test_replay_baseline_command_strings(rec_dir):
+    rec_dir.mkdir()
+    legacy = {
+        CMD_LINE: ["syncup_apps", "c.yml"],
+        RECORDS: [
+            [
+                "az storage share list --account-name st  --only-show-errors",
+                0,
+                "[]",
+                "",
+            ],
+            ["az appservice plan delete -y -n p1 -g g ", 0, "", ""],
+            ["az appservice plan create -n p1 -g g --sku B1 -l westus  ", 0, "", ""],
+        ],
+    }
+    (rec_dir / "baseline.json").write_text(json.dumps(legacy))
+    _, records = parse_recorder_file("baseline.json")
+    player = Player(records)
+    az = AzCmd(replay_from=player)
+    Context(az).config = SimpleNamespace(group="g")
+    az.ctx.state = SimpleNamespace(group="g", location_id=lambda loc: loc)
+    assert az.list_file_shares(SimpleNamespace(name="st")) == []
+    az.delete_app_plan(SimpleNamespace(name="p1"))
+    plan = SimpleNamespace(name="p1", kind="app", sku="B1", location="westus")
+    az.create_app_plan(plan)
+    player.assert_at_the_end()
+
+
+def test_rest_location_mapping():
+    locations = [{"name": "westus", "displayName": "West US"}]
+    rest = StubRestCmd([Response(200, {"value": locations})])
+    assert rest.get_location_mapping() == {"westus": "westus"}
+    path = rest.stub_session.calls[0][0]
+    assert path == "https://management.azure.com/subscriptions/s/locations"
@@ -2,7 +2,7 @@ import sys
 from datetime import datetime
 
 from azup import CliActions, filter_options, print_err
-from azup.cmd import AzCmd, Player, Recorder, add_test, parse_recorder_file
+from azup.cmd import AzCmd, AzRestCmd, Player, Recorder, add_test, parse_recorder_file
 from azup.main import main
 
 
@@ -27,25 +27,35 @@ def t_main(test_args=sys.argv[1:], now=datetime.utcnow()):
     play = None
 
     actions = TestActions()
+    rest_opt = ["-rest"] if "rest" in options else []
     if "replay" in options:
         cmd_line, records = parse_recorder_file(options["replay"])
         if not len(args):
             print_err(f"Replaying: {' '.join(cmd_line)}")
-            args = cmd_line
+            args, recorded_options = filter_options(cmd_line)
+            if "rest" in recorded_options:
+                rest_opt = ["-rest"]
         play = Player(records)
+        # let replayed output be freed as Player pops it
+        del records
     else:
         action = args[0]
         if "record" in options:
-            rec = Recorder(options["record"], args)
+            rec = Recorder(options["record"], args + rest_opt)
             test_args.remove(f"-record:{options['record']}")
         elif "add_test" in options:
-            rec = Recorder(f"{action}*", args)
+            rec = Recorder(f"{action}*", args + rest_opt)
         elif actions._check_action(action):
             return actions._invoke(args)
         else:
             return main(test_args)
 
-    out = main(args, AzCmd(record_to=rec, replay_from=play, now=now))
+    az_cmd_cls = AzRestCmd if rest_opt else AzCmd
+    az_cmd = az_cmd_cls(record_to=rec, replay_from=play, now=now)
+    try:
+        out = main(args, az_cmd)
+    finally:
+        az_cmd.close()
 
     if "add_test" in options:
         test_args.remove("-add_test")
@@ -6,6 +6,15 @@ cmdclass_dict = {}  # type:ignore
 
 install_requires = ["pyyaml", "python-dateutil"]
 
+# optional, speeds up parsing of `az` output and recordings
+fast_requires = ["orjson", "ijson"]
+
+# optional, `-record:<name>.msgpack` stores recording in MessagePack
+msgpack_requires = ["msgpack"]
+
+# optional, `-rest` option to query ARM REST API directly
+rest_requires = ["requests", "azure-identity"]
+
 dev_requires = [
     "hs-build-tools",
     "coverage",
@@ -59,6 +68,11 @@ setup(
     cmdclass=cmdclass_dict,
     entry_points={"console_scripts": ["azup=azup.main:print_main"]},
     install_requires=install_requires,
-    extras_require={"dev": dev_requires},
+    extras_require={
+        "dev": dev_requires,
+        "fast": fast_requires,
+        "rest": rest_requires,
+        "msgpack": msgpack_requires,
+    },
     zip_safe=False,
 )